@@ -5,37 +5,68 @@ Plex Dance script - temporarily moves files to force Plex to refresh its databas
 
 import sys
 import os
+import io
 import time
+import re
 import shutil
 import tempfile
 import argparse
+import bisect
+import functools
 from pathlib import Path
 from plexapi.server import PlexServer
+from plexapi.exceptions import NotFound
 import shlex
 import signal
 import atexit
+from collections import defaultdict, namedtuple
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def apply_path_mapping(path, mapping):
-    """Apply path mapping from Plex container paths to local system paths
+# Serialises output from worker threads so progress lines don't interleave
+print_lock = threading.Lock()
+
+def locked_print(*args, **kwargs):
+    """Print while holding print_lock"""
+    with print_lock:
+        print(*args, **kwargs)
+
+# Parsed --path-mapping; plex_root_len is precomputed for make_path_mapper
+PathMapping = namedtuple('PathMapping', ['local_root', 'plex_root', 'plex_root_len'])
+
+# Progress lines are written to stderr in batches of this size
+PROGRESS_FLUSH_EVERY = 32
+
+def flush_progress(progress_buf):
+    """Write buffered progress lines to stderr in one call and empty the buffer"""
+    if progress_buf:
+        with print_lock:
+            sys.stderr.write(''.join(progress_buf))
+            sys.stderr.flush()
+        progress_buf.clear()
+
+def make_path_mapper(mapping):
+    """Return a function mapping Plex container paths to local system paths
     
     Args:
-        path: Plex file path
-        mapping: Dict with 'local_root' and 'plex_root' keys
+        mapping: PathMapping from parse_path_mapping, or None
     
     Returns:
-        Mapped path for local system
+        Function taking a Plex path and returning the local path; the identity
+        function when no mapping is configured, so callers need no guard
     """
-    if not mapping or 'local_root' not in mapping or 'plex_root' not in mapping:
-        return path
+    if not mapping:
+        return lambda path: path
     
-    plex_root = mapping['plex_root']
-    local_root = mapping['local_root']
+    local_root, plex_root, plex_root_len = mapping
     
-    # Replace plex_root with local_root
-    if path.startswith(plex_root):
-        return path.replace(plex_root, local_root, 1)
-    else:
+    def map_path(path):
+        # Replace plex_root with local_root
+        if path[:plex_root_len] == plex_root:
+            return local_root + path[plex_root_len:]
         return path
+    
+    return map_path
 
 def parse_path_mapping(mapping_str):
     """Parse path mapping string in format 'local_root:plex_root'"""
@@ -44,55 +75,70 @@ def parse_path_mapping(mapping_str):
     
     try:
         local_root, plex_root = mapping_str.split(':', 1)
-        return {
-            'local_root': local_root.strip(),
-            'plex_root': plex_root.strip()
-        }
+        local_root = local_root.strip()
+        plex_root = plex_root.strip()
+        return PathMapping(local_root, plex_root, len(plex_root))
     except ValueError:
         print(f"Error: Invalid path mapping format '{mapping_str}'. Use 'local_root:plex_root'")
         sys.exit(1)
 
+@functools.lru_cache(maxsize=None)
+def _dev_for_dir(directory):
+    """Return st_dev for directory, or its nearest existing ancestor (cached per directory)"""
+    try:
+        while not os.path.exists(directory):
+            parent = os.path.dirname(directory)
+            if parent == directory:  # reached root
+                return None
+            directory = parent
+        return os.stat(directory).st_dev
+    except OSError:
+        return None
+
 def are_on_same_filesystem(path1, path2):
-    """Check if two paths are on the same filesystem"""
+    """Check if two paths are on the same filesystem
+    
+    Compares the devices of the parent directories so albums sharing a parent
+    (and every album sharing a temp directory) cost a single stat.
+    """
+    dev1 = _dev_for_dir(os.path.dirname(path1))
+    dev2 = _dev_for_dir(os.path.dirname(path2))
+    return dev1 is not None and dev1 == dev2
+
+@functools.lru_cache(maxsize=4096)
+def _appledouble_siblings(parent_dir):
+    """Return the names of AppleDouble (._*) files in parent_dir, scanned once per directory"""
     try:
-        # If path2 doesn't exist, check its parent directory
-        check_path2 = path2
-        while not os.path.exists(check_path2):
-            parent = os.path.dirname(check_path2)
-            if parent == check_path2:  # reached root
-                return False
-            check_path2 = parent
-        
-        stat1 = os.stat(path1)
-        stat2 = os.stat(check_path2)
-        return stat1.st_dev == stat2.st_dev
+        with os.scandir(parent_dir) as entries:
+            return frozenset(entry.name for entry in entries if entry.name.startswith('._'))
     except OSError:
-        return False
+        return frozenset()
 
-def move_file(orig_path, temp_path, original_plex_path=None):
-    """Move a single file to temporary location using atomic rename"""
+def move_file(orig_path, temp_path, original_plex_path=None, temp_dir_fd=None):
+    """Move a single file to temporary location using atomic rename
+    
+    The temp directory must already exist; main() creates it once per library.
+    If temp_dir_fd is an open descriptor for that directory, the destination is
+    resolved relative to it instead of walking the full temp path again.
+    Returns False without moving anything once stop_moves is set.
+    """
+    if stop_moves.is_set():
+        return False
+    
     try:
-        # First check if source exists and is accessible
-        if not os.path.exists(orig_path):
-            if original_plex_path:
-                print(f"Warning: Translated path does not exist: {orig_path} (from {original_plex_path})")
-            else:
-                print(f"Warning: Source path does not exist: {orig_path}")
-            return False
-        
-        # Create parent directory if needed
-        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-        
         # Check if on same filesystem for atomic operation
         if not are_on_same_filesystem(orig_path, temp_path):
             if original_plex_path:
-                print(f"Error: Source and temp directory not on same filesystem: {orig_path} (from {original_plex_path})")
+                locked_print(f"Error: Source and temp directory not on same filesystem: {orig_path} (from {original_plex_path})")
             else:
-                print(f"Error: Source and temp directory not on same filesystem: {orig_path}")
+                locked_print(f"Error: Source and temp directory not on same filesystem: {orig_path}")
             return False
         
         # Use os.rename for atomic operation
-        os.rename(orig_path, temp_path)
+        if temp_dir_fd is not None:
+            os.rename(orig_path, os.path.basename(temp_path), dst_dir_fd=temp_dir_fd)
+        else:
+            os.rename(orig_path, temp_path)
         
         # Also move any associated AppleDouble file
         parent_dir = os.path.dirname(orig_path)
@@ -100,36 +146,40 @@ def move_file(orig_path, temp_path, original_plex_path=None):
         appledouble_orig = os.path.join(parent_dir, f"._{basename}")
         appledouble_temp = os.path.join(os.path.dirname(temp_path), f"._{os.path.basename(temp_path)}")
         
-        if os.path.exists(appledouble_orig):
+        if f"._{basename}" in _appledouble_siblings(parent_dir):
             try:
-                os.rename(appledouble_orig, appledouble_temp)
+                if temp_dir_fd is not None:
+                    os.rename(appledouble_orig, os.path.basename(appledouble_temp), dst_dir_fd=temp_dir_fd)
+                else:
+                    os.rename(appledouble_orig, appledouble_temp)
             except Exception:
                 pass  # AppleDouble file move failed, but that's not critical
         
         return True
     except FileNotFoundError as e:
+        # Missing sources are reported by the rename itself rather than a separate stat
         if original_plex_path:
-            print(f"File not found: {orig_path} (from {original_plex_path})")
+            locked_print(f"Warning: Translated path does not exist: {orig_path} (from {original_plex_path})")
         else:
-            print(f"File not found: {orig_path}")
+            locked_print(f"Warning: Source path does not exist: {orig_path}")
         return False
     except PermissionError as e:
         if original_plex_path:
-            print(f"Permission denied: {orig_path} (from {original_plex_path})")
+            locked_print(f"Permission denied: {orig_path} (from {original_plex_path})")
         else:
-            print(f"Permission denied: {orig_path}")
+            locked_print(f"Permission denied: {orig_path}")
         return False
     except OSError as e:
         if original_plex_path:
-            print(f"Filesystem error with {orig_path} (from {original_plex_path}): {e}")
+            locked_print(f"Filesystem error with {orig_path} (from {original_plex_path}): {e}")
         else:
-            print(f"Filesystem error with {orig_path}: {e}")
+            locked_print(f"Filesystem error with {orig_path}: {e}")
         return False
     except Exception as e:
         if original_plex_path:
-            print(f"Error moving {orig_path} (from {original_plex_path}) to {temp_path}: {e}")
+            locked_print(f"Error moving {orig_path} (from {original_plex_path}) to {temp_path}: {e}")
         else:
-            print(f"Error moving {orig_path} to {temp_path}: {e}")
+            locked_print(f"Error moving {orig_path} to {temp_path}: {e}")
         return False
 
 def restore_file(temp_path, orig_path):
@@ -146,7 +196,7 @@ def restore_file(temp_path, orig_path):
         appledouble_temp = os.path.join(os.path.dirname(temp_path), f"._{temp_basename}")
         appledouble_orig = os.path.join(os.path.dirname(orig_path), f"._{orig_basename}")
         
-        if os.path.exists(appledouble_temp):
+        if f"._{temp_basename}" in _appledouble_siblings(os.path.dirname(temp_path)):
             try:
                 os.rename(appledouble_temp, appledouble_orig)
             except Exception:
@@ -154,9 +204,22 @@ def restore_file(temp_path, orig_path):
         
         return True
     except Exception as e:
-        print(f"Error restoring {temp_path} to {orig_path}: {e}")
+        locked_print(f"Error restoring {temp_path} to {orig_path}: {e}")
         return False
 
+def has_ancestor_in(path, paths):
+    """Return True if any parent directory of path is itself in paths
+    
+    Albums nested inside another listed album (Album and Album/CD2) must not
+    be moved or restored concurrently with it, so callers run these after the rest.
+    """
+    parent = os.path.dirname(path)
+    while parent != path:
+        if parent in paths:
+            return True
+        path, parent = parent, os.path.dirname(parent)
+    return False
+
 def get_plex_library_locations(plex_url, plex_token, music_library_name='Music'):
     """Get the library locations from Plex server"""
     try:
@@ -170,62 +233,93 @@ def get_plex_library_locations(plex_url, plex_token, music_library_name='Music')
         print("Check your Plex URL, token, and library name, or use --skip-validation", file=sys.stderr)
         sys.exit(1)
 
-def check_albums_removed_from_plex(plex_url, plex_token, music_library_name, moved_albums_with_ids, path_mapping=None):
-    """Check if moved albums are no longer visible in Plex library using fast album ID lookup"""
+# Up to this many outstanding album IDs are checked with a single
+# /library/metadata/{ids} request instead of listing every album
+REMAINING_ALBUMS_QUERY_LIMIT = 200
+
+# Smallest delay allowed between Plex checks, so a zero or negative
+# --poll-base-interval/--poll-max-interval can't poll back-to-back
+MIN_POLL_INTERVAL = 0.5
+
+def check_albums_removed_from_plex(music_library, moved_albums_with_ids):
+    """Check if moved albums are no longer visible in Plex library using fast album ID lookup
+    
+    Returns (all_removed, still_visible) where still_visible is the subset of
+    moved_albums_with_ids Plex can still see, so callers can re-check only those.
+    """
     try:
-        print("connecting...", file=sys.stderr, end=" ", flush=True)
-        plex = PlexServer(plex_url, plex_token)
-        music_library = plex.library.section(music_library_name)
-        
         total_albums_to_check = sum(len(album_ids) for _, album_ids in moved_albums_with_ids)
         print(f"checking {total_albums_to_check} albums...", file=sys.stderr, end=" ", flush=True)
         
-        still_visible_paths = []
+        # Legacy mode: index all album directories once instead of per path
+        dir_index = {}
+        if any(not album_ids for _, album_ids in moved_albums_with_ids):
+            print("(legacy check)", file=sys.stderr, end=" ", flush=True)
+            for album in music_library.searchAlbums():
+                tracks = album.tracks()
+                if tracks and hasattr(tracks[0], 'locations') and tracks[0].locations:
+                    album_dir = os.path.dirname(tracks[0].locations[0])
+                    dir_index[album_dir] = album
+        
+        # Fast mode: once few albums remain, ask about just those in one request;
+        # otherwise list the bare ratingKeys of every album in one request rather
+        # than fetching (and building full Album objects for) each moved album
+        remaining_ids = [album_id.strip() for _, album_ids in moved_albums_with_ids
+                         for album_id in album_ids if album_id.strip().isdigit()]
+        present_ids = set()
+        if 0 < len(remaining_ids) <= REMAINING_ALBUMS_QUERY_LIMIT:
+            try:
+                root = music_library._server.query(f"/library/metadata/{','.join(remaining_ids)}")
+                present_ids = {elem.get('ratingKey') for elem in root}
+            except NotFound:
+                pass  # none of the remaining albums exist any more (what we want)
+        elif remaining_ids:
+            root = music_library._server.query(f'/library/sections/{music_library.key}/all?type=9&includeGuids=0')
+            present_ids = {elem.get('ratingKey') for elem in root.findall('Directory')}
+        
+        still_visible = []
         
         # Check each moved path and its associated album IDs
         for plex_path, album_ids in moved_albums_with_ids:
             if not album_ids:
                 # Legacy mode: fall back to path-based checking
-                print("(legacy check)", file=sys.stderr, end=" ", flush=True)
-                # Get all albums and check by path - this is the old slow method
-                all_albums = music_library.searchAlbums()
-                for album in all_albums:
-                    tracks = album.tracks()
-                    if tracks and hasattr(tracks[0], 'locations') and tracks[0].locations:
-                        track_path = tracks[0].locations[0]
-                        album_dir = os.path.dirname(track_path)
-                        if album_dir == plex_path:
-                            still_visible_paths.append(plex_path)
-                            break
-            else:
-                # Fast mode: check specific album IDs
-                path_has_visible_albums = False
-                for album_id in album_ids:
-                    try:
-                        # Try to fetch the album by ID - if it exists, the album is still visible
-                        album = music_library.fetchItem(int(album_id))
-                        if album:
-                            path_has_visible_albums = True
-                            break
-                    except Exception:
-                        # Album not found = it's been removed (what we want)
-                        continue
-                
-                if path_has_visible_albums:
-                    still_visible_paths.append(plex_path)
+                if dir_index.get(plex_path) is not None:
+                    still_visible.append((plex_path, album_ids))
+            elif any(album_id.strip() in present_ids for album_id in album_ids):
+                still_visible.append((plex_path, album_ids))
         
-        return len(still_visible_paths) == 0, len(still_visible_paths)
+        return len(still_visible) == 0, still_visible
         
     except Exception as e:
         print(f"Warning: Could not check Plex status: {e}", file=sys.stderr)
-        return False, len(moved_albums_with_ids)
+        return False, moved_albums_with_ids
 
-def validate_paths_in_library(file_paths, library_locations, path_mapping=None):
-    """Validate that all paths are within Plex library directories"""
+def find_library_root(path, sorted_locations):
+    """Return the longest library location that prefixes path, or None
+    
+    sorted_locations must be sorted lexicographically. Any location that
+    prefixes path sorts between that prefix and path, so a bisect finds the
+    candidate; on a miss the search narrows to the common prefix and retries.
+    """
+    while True:
+        i = bisect.bisect_right(sorted_locations, path) - 1
+        if i < 0:
+            return None
+        loc = sorted_locations[i]
+        if path.startswith(loc):
+            return loc
+        path = os.path.commonprefix([path, loc])
+
+def validate_paths_in_library(file_paths, library_locations, path_mapping=None, fail_fast=False):
+    """Validate that all paths are within Plex library directories
+    
+    With fail_fast, exit on the first invalid path instead of collecting them all.
+    """
     if not library_locations:
         print("Warning: No library locations available for validation", file=sys.stderr)
         return file_paths
     
+    sorted_locations = sorted(library_locations)
     valid_paths = []
     invalid_paths = []
     
@@ -233,13 +327,17 @@ def validate_paths_in_library(file_paths, library_locations, path_mapping=None):
         # Apply reverse path mapping for validation (local -> plex path)
         validation_path = path
         if path_mapping:
-            validation_path = path.replace(path_mapping['local_root'], path_mapping['plex_root'], 1)
+            validation_path = path.replace(path_mapping.local_root, path_mapping.plex_root, 1)
         
         # Check if path is within any library location
-        is_valid = any(validation_path.startswith(loc) for loc in library_locations)
+        is_valid = find_library_root(validation_path, sorted_locations) is not None
         
         if is_valid:
             valid_paths.append(path)
+        elif fail_fast:
+            print("Error: path is outside Plex library locations:", file=sys.stderr)
+            print(f"  {path}", file=sys.stderr)
+            sys.exit(1)
         else:
             invalid_paths.append(path)
     
@@ -257,6 +355,10 @@ def validate_paths_in_library(file_paths, library_locations, path_mapping=None):
 library_temp_dirs = {}
 temp_paths = []
 file_paths = []
+max_concurrency = 8
+# Set by the signal handler so queued Phase 1 moves stop renaming into temp
+# directories that cleanup is about to list and remove
+stop_moves = threading.Event()
 
 def cleanup_and_restore():
     """Cleanup function called on exit or signal"""
@@ -271,6 +373,9 @@ def cleanup_and_restore():
         
     print("\n🔄 Cleaning up and restoring files...", file=sys.stderr)
     
+    # Reverse lookup from temp path to original path (zip stops at the shorter list)
+    temp_to_orig = dict(zip(temp_paths, file_paths))
+    
     # Restore any files still in temp directories
     for library_root, temp_dir in temp_dirs_to_clean.items():
         try:
@@ -281,19 +386,19 @@ def cleanup_and_restore():
                 
                 if album_dirs:
                     print(f"Restoring {len(album_dirs)} albums from {temp_dir}...", file=sys.stderr)
-                    for temp_file in album_dirs:
+                    # Restored one at a time: this runs from atexit, where no new
+                    # threads can be started, and parents must go back before children
+                    for temp_file in sorted(album_dirs, key=lambda name: temp_to_orig.get(os.path.join(temp_dir, name), '')):
                         temp_path = os.path.join(temp_dir, temp_file)
                         if os.path.isdir(temp_path):
                             # Find original path from our tracking
-                            for i, tracked_temp_path in enumerate(temp_paths):
-                                if tracked_temp_path == temp_path and i < len(file_paths):
-                                    orig_path = file_paths[i]
-                                    try:
-                                        print(f"Restoring {os.path.basename(temp_path)} to {orig_path}", file=sys.stderr)
-                                        os.rename(temp_path, orig_path)
-                                    except Exception as restore_e:
-                                        print(f"Failed to restore {temp_path}: {restore_e}", file=sys.stderr)
-                                    break
+                            orig_path = temp_to_orig.get(temp_path)
+                            if orig_path is not None:
+                                try:
+                                    print(f"Restoring {temp_file} to {orig_path}", file=sys.stderr)
+                                    os.rename(temp_path, orig_path)
+                                except Exception as restore_e:
+                                    print(f"Failed to restore {temp_path}: {restore_e}", file=sys.stderr)
                             else:
                                 print(f"Warning: Could not determine original location for {temp_path}", file=sys.stderr)
                 
@@ -316,40 +421,38 @@ def cleanup_and_restore():
         except Exception as e:
             print(f"Warning: Failed to clean up {temp_dir}: {e}", file=sys.stderr)
 
+# Anything other than word characters, '-', '.' and ' ' is replaced in temp names
+UNSAFE_NAME_CHARS = re.compile(r'[^\w\-. ]')
+
 def truncate_utf8_safe(text, max_bytes):
     """Truncate text to max_bytes while preserving valid UTF-8"""
-    if len(text.encode('utf-8')) <= max_bytes:
-        return text
-    
-    # Start with max_bytes and work backwards to find valid UTF-8 boundary
     encoded = text.encode('utf-8')
-    for i in range(max_bytes, 0, -1):
-        try:
-            truncated = encoded[:i].decode('utf-8')
-            return truncated
-        except UnicodeDecodeError:
-            continue
+    if len(encoded) <= max_bytes:
+        return text
     
-    # Fallback: just return ascii-safe characters
-    return ''.join(c for c in text if ord(c) < 128)[:max_bytes]
+    # Back up over continuation bytes (0b10xxxxxx) to the start of the
+    # character that straddles the limit - at most 3 steps
+    i = max_bytes
+    while i > 0 and (encoded[i] & 0xC0) == 0x80:
+        i -= 1
+    return encoded[:i].decode('utf-8')
 
 def safe_temp_name(index, artist, album, max_filename_bytes=255):
     """Create a safe temp directory name under filesystem limits"""
     # Remove problematic characters
-    safe_chars = lambda s: ''.join(c if c.isalnum() or c in '-_. ' else '_' for c in s)
-    artist = safe_chars(artist)
-    album = safe_chars(album)
+    artist = UNSAFE_NAME_CHARS.sub('_', artist)
+    album = UNSAFE_NAME_CHARS.sub('_', album)
     
     # Start with the full name
-    base_name = f"{index}_{artist}_{album}"
+    index_part = f"{index}_"
+    base_name = f"{index_part}{artist}_{album}"
     
     # If it's already short enough, return it
     if len(base_name.encode('utf-8')) <= max_filename_bytes:
         return base_name
     
-    # Calculate space needed for index and separators
-    index_part = f"{index}_"
-    remaining_bytes = max_filename_bytes - len(index_part.encode('utf-8')) - 1  # -1 for separator
+    # Calculate space needed for index and separators (index_part is ASCII)
+    remaining_bytes = max_filename_bytes - len(index_part) - 1  # -1 for separator
     
     # Split remaining space between artist and album
     artist_bytes = remaining_bytes // 2
@@ -359,18 +462,41 @@ def safe_temp_name(index, artist, album, max_filename_bytes=255):
     artist_trunc = truncate_utf8_safe(artist, artist_bytes)
     album_trunc = truncate_utf8_safe(album, album_bytes)
     
-    return f"{index}_{artist_trunc}_{album_trunc}"
+    return f"{index_part}{artist_trunc}_{album_trunc}"
+
+def parse_input(lines):
+    """Yield (path, album_ids) for each non-empty input line
+    
+    New format lines are "path\talbum_id1,album_id2"; legacy lines are just a
+    path and yield an empty album ID list.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if '\t' in line:
+            path, album_ids_str = line.split('\t', 1)
+            yield path, album_ids_str.split(',')
+        else:
+            yield line, []
 
 def signal_handler(signum, frame):
-    """Handle interrupt signals gracefully"""
+    """Handle interrupt signals gracefully
+    
+    The handler runs on the main thread, possibly while it holds print_lock
+    or is waiting on worker threads, so it only stops Phase 1 and exits.
+    Unwinding main() releases the lock and waits for in-flight moves (queued
+    ones return at once); cleanup_and_restore then runs from atexit.
+    """
+    if stop_moves.is_set():
+        print(f"\n⚠️  Received signal {signum}, already cleaning up...", file=sys.stderr)
+        return
     print(f"\n⚠️  Received signal {signum}, cleaning up...", file=sys.stderr)
-    cleanup_and_restore()
-    # Unregister atexit handler to prevent double cleanup
-    atexit.unregister(cleanup_and_restore)
+    stop_moves.set()
     sys.exit(1)
 
 def main():
-    global library_temp_dirs, temp_paths, file_paths
+    global library_temp_dirs, temp_paths, file_paths, max_concurrency
     
     # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
@@ -393,8 +519,16 @@ def main():
                        help='Path mapping in format "local_root:plex_root" to map container paths to local paths')
     parser.add_argument('--parallel', action='store_true',
                        help='Process all directories simultaneously instead of one at a time (use with caution)')
+    parser.add_argument('--max-concurrency', type=int, default=8,
+                       help='Maximum number of albums to move at once, or to restore when cleaning up after an interruption (default: 8)')
+    parser.add_argument('--restore-parallelism', type=int, default=4,
+                       help='Maximum number of albums to restore at once in Phase 3; 1 restores them one at a time (default: 4)')
     parser.add_argument('--max-wait', type=int, default=300,
                        help='Maximum time to wait for Plex to notice changes (default: 300 seconds)')
+    parser.add_argument('--poll-base-interval', type=float, default=2,
+                       help='Initial delay between Plex checks; grows 1.5x per check, minimum 0.5 (default: 2 seconds)')
+    parser.add_argument('--poll-max-interval', type=float, default=30,
+                       help='Maximum delay between Plex checks, minimum 0.5 (default: 30 seconds)')
     parser.add_argument('--no-dry-run', action='store_true',
                        help='Actually perform the operations (default: dry-run mode)')
     parser.add_argument('--plex-url', 
@@ -408,11 +542,18 @@ def main():
                        help='Name of music library in Plex (default: Music)')
     parser.add_argument('--skip-validation', action='store_true',
                        help='Skip Plex library path validation (use with caution)')
+    parser.add_argument('--fail-fast', action=argparse.BooleanOptionalAction, default=True,
+                       help='Stop at the first path outside the Plex library instead of listing them all (default: on)')
     
     args = parser.parse_args()
+    max_concurrency = max(1, args.max_concurrency)
+    args.restore_parallelism = max(1, args.restore_parallelism)
+    args.poll_base_interval = max(MIN_POLL_INTERVAL, args.poll_base_interval)
+    args.poll_max_interval = max(MIN_POLL_INTERVAL, args.poll_max_interval)
     
     # Parse path mapping
     path_mapping = parse_path_mapping(args.path_mapping) if args.path_mapping else None
+    map_path = make_path_mapper(path_mapping)
     
     # Read file paths and album IDs
     file_paths = []
@@ -422,36 +563,29 @@ def main():
         if not os.path.exists(args.input_file):
             print(f"Error: File '{args.input_file}' not found.")
             sys.exit(1)
-        with open(args.input_file, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f if line.strip()]
+        input_stream = open(args.input_file, 'r', encoding='utf-8', newline='')
     else:
         # Read from stdin
-        lines = [line.strip() for line in sys.stdin if line.strip()]
-    
-    if not lines:
-        print("No file paths provided.")
-        sys.exit(1)
+        input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
     
-    # Parse path and album IDs from each line
-    for line in lines:
-        if '\t' in line:
-            # New format: path\talbum_id1,album_id2
-            path, album_ids_str = line.split('\t', 1)
-            album_ids = album_ids_str.split(',')
+    # Parse path and album IDs in a single streaming pass
+    with input_stream:
+        for path, album_ids in parse_input(input_stream):
             file_paths.append(path)
             album_ids_map[path] = album_ids
-        else:
-            # Legacy format: just path
-            file_paths.append(line)
-            album_ids_map[line] = []
     
-    # Keep original Plex paths for validation, store mapping info
-    plex_paths = file_paths.copy()
+    if not file_paths:
+        print("No file paths provided.")
+        sys.exit(1)
+    
+    # Keep original Plex paths for validation, store mapping info (file_paths is
+    # not mutated again, so an alias is enough)
+    plex_paths = file_paths
     if path_mapping:
-        print(f"Using path mapping: {path_mapping['local_root']} -> {path_mapping['plex_root']}")
+        print(f"Using path mapping: {path_mapping.local_root} -> {path_mapping.plex_root}")
         print("Path mapping examples:")
         for i, plex_path in enumerate(plex_paths[:3]):
-            local_path = apply_path_mapping(plex_path, path_mapping)
+            local_path = map_path(plex_path)
             album_ids = album_ids_map.get(plex_path, [])
             album_ids_str = f" ({','.join(album_ids)})" if album_ids else ""
             print(f"  {plex_path}{album_ids_str} -> {local_path}")
@@ -463,7 +597,8 @@ def main():
             sys.exit(1)
         print("Validating paths against Plex library locations...", file=sys.stderr)
         library_locations = get_plex_library_locations(args.plex_url, args.plex_token, args.music_library)
-        plex_paths = validate_paths_in_library(plex_paths, library_locations, None)  # No path mapping for validation
+        plex_paths = validate_paths_in_library(plex_paths, library_locations, None, args.fail_fast)  # No path mapping for validation
+        sorted_library_locations = sorted(library_locations)
     
     print(f"Processing {len(plex_paths)} files...")
     
@@ -475,7 +610,7 @@ def main():
         
         # Validate each path
         for plex_path in sorted(plex_paths):
-            local_path = apply_path_mapping(plex_path, path_mapping) if path_mapping else plex_path
+            local_path = map_path(plex_path)
             print(f"\n   Checking: {local_path}")
             
             # Check if local path exists
@@ -487,16 +622,13 @@ def main():
             # Find library location and temp directory
             library_root = None
             if not args.skip_validation:
-                for loc in library_locations:
-                    if plex_path.startswith(loc):
-                        library_root = loc
-                        break
+                library_root = find_library_root(plex_path, sorted_library_locations)
             
             if not library_root:
                 library_root = os.path.dirname(plex_path)
             
             # Map library root to local path and get parent directory  
-            local_library_root = apply_path_mapping(library_root, path_mapping) if path_mapping else library_root
+            local_library_root = map_path(library_root)
             local_library_parent = os.path.dirname(local_library_root)
             temp_dir = os.path.join(local_library_parent, "tmp.plexdance")
             
@@ -541,96 +673,135 @@ def main():
         # temp_paths and file_paths are global for signal handling
         move_operations = []
         
+        library_info = {}  # library_root -> temp_dir, resolved once per library
+        
         for i, plex_path in enumerate(plex_paths):
             # Apply path mapping to get local path
-            local_path = apply_path_mapping(plex_path, path_mapping) if path_mapping else plex_path
+            local_path = map_path(plex_path)
+            local_dir, album_name = os.path.split(local_path)
+            artist_name = os.path.basename(local_dir)
             
             # Find which library location this path belongs to (using Plex path)
             library_root = None
             if not args.skip_validation:
-                for loc in library_locations:
-                    if plex_path.startswith(loc):
-                        library_root = loc
-                        break
+                library_root = find_library_root(plex_path, sorted_library_locations)
             
             if not library_root:
                 # Fallback: use the directory containing the album directory (Plex path)
                 library_root = os.path.dirname(plex_path)
             
-            # Map library root to local path and get parent directory  
-            local_library_root = apply_path_mapping(library_root, path_mapping) if path_mapping else library_root
-            local_library_parent = os.path.dirname(local_library_root)
-            
-            # Create temp directory for this library location
-            if local_library_parent not in library_temp_dirs:
-                temp_dir = os.path.join(local_library_parent, "tmp.plexdance")
+            temp_dir = library_info.get(library_root)
+            if temp_dir is None:
+                # Map library root to local path and get parent directory  
+                local_library_root = map_path(library_root)
+                local_library_parent = os.path.dirname(local_library_root)
                 
-                # Check if temp directory already exists
-                if os.path.exists(temp_dir):
-                    # Check if it's empty (ignoring hidden files)
-                    temp_contents = [f for f in os.listdir(temp_dir) if not f.startswith('.')]
-                    if not temp_contents:
-                        print(f"Found empty temp directory, removing: {temp_dir}", file=sys.stderr)
-                        os.rmdir(temp_dir)
-                    else:
-                        print(f"Error: Temp directory already exists: {temp_dir}", file=sys.stderr)
-                        print("This may indicate a previous interrupted run. Please check for files to restore or remove manually.", file=sys.stderr)
-                        restore_log = os.path.join(temp_dir, "restore.log")
-                        if os.path.exists(restore_log):
-                            print(f"To restore files manually, run: bash {restore_log}", file=sys.stderr)
+                # Create temp directory for this library location
+                if local_library_parent not in library_temp_dirs:
+                    temp_dir = os.path.join(local_library_parent, "tmp.plexdance")
+                    
+                    # Check if temp directory already exists
+                    if os.path.exists(temp_dir):
+                        # Check if it's empty (ignoring hidden files)
+                        temp_contents = [f for f in os.listdir(temp_dir) if not f.startswith('.')]
+                        if not temp_contents:
+                            print(f"Found empty temp directory, removing: {temp_dir}", file=sys.stderr)
+                            os.rmdir(temp_dir)
+                        else:
+                            print(f"Error: Temp directory already exists: {temp_dir}", file=sys.stderr)
+                            print("This may indicate a previous interrupted run. Please check for files to restore or remove manually.", file=sys.stderr)
+                            restore_log = os.path.join(temp_dir, "restore.log")
+                            if os.path.exists(restore_log):
+                                print(f"To restore files manually, run: bash {restore_log}", file=sys.stderr)
+                            sys.exit(1)
+                    
+                    # Check same filesystem (using mapped local path)
+                    if not are_on_same_filesystem(local_path, temp_dir):
+                        print(f"Error: Album directory and temp directory not on same filesystem: {local_path}", file=sys.stderr)
+                        print(f"  Album path: {local_path}", file=sys.stderr)
+                        print(f"  Temp dir: {temp_dir}", file=sys.stderr)
                         sys.exit(1)
+                    
+                    os.makedirs(temp_dir, exist_ok=True)
+                    
+                    # Create lock file
+                    lock_file = os.path.join(temp_dir, "lock")
+                    with open(lock_file, 'w') as f:
+                        f.write(f"PID: {os.getpid()}\n")
+                        f.write(f"Started: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                    
+                    library_temp_dirs[local_library_parent] = temp_dir
                 
-                # Check same filesystem (using mapped local path)
-                if not are_on_same_filesystem(local_path, temp_dir):
-                    print(f"Error: Album directory and temp directory not on same filesystem: {local_path}", file=sys.stderr)
-                    print(f"  Album path: {local_path}", file=sys.stderr)
-                    print(f"  Temp dir: {temp_dir}", file=sys.stderr)
-                    sys.exit(1)
-                
-                os.makedirs(temp_dir, exist_ok=True)
-                
-                # Create lock file
-                lock_file = os.path.join(temp_dir, "lock")
-                with open(lock_file, 'w') as f:
-                    f.write(f"PID: {os.getpid()}\n")
-                    f.write(f"Started: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-                
-                library_temp_dirs[local_library_parent] = temp_dir
+                temp_dir = library_temp_dirs[local_library_parent]
+                library_info[library_root] = temp_dir
             
-            temp_dir = library_temp_dirs[local_library_parent]
             # Create human-readable temp name: {number}_{artist}_{album}
-            album_name = os.path.basename(local_path)
-            artist_name = os.path.basename(os.path.dirname(local_path))
             safe_name = safe_temp_name(i, artist_name, album_name)
             temp_path = os.path.join(temp_dir, safe_name)
             temp_paths.append(temp_path)
             move_operations.append((local_path, temp_path, plex_path))
         
-        # Write restore log before moving files
+        # Group restore commands by temp directory so each log is built in one pass
+        restore_commands = defaultdict(list)
+        for local_path, temp_path, _ in move_operations:
+            restore_commands[os.path.dirname(temp_path)].append(
+                f"mv {shlex.quote(temp_path)} {shlex.quote(local_path)}\n")
+        
+        # Write restore log before moving files, as a single write per log
         for library_root, temp_dir in library_temp_dirs.items():
             restore_log = os.path.join(temp_dir, "restore.log")
-            with open(restore_log, 'w') as f:
-                f.write("#!/bin/bash\n")
-                f.write("# Restore script for plex-dance operation\n")
-                f.write(f"# Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                for local_path, temp_path, _ in move_operations:
-                    if temp_path.startswith(temp_dir):
-                        f.write(f"mv {shlex.quote(temp_path)} {shlex.quote(local_path)}\n")
-        
-        # Execute moves sequentially with progress indication
-        results = []
-        print("Moving albums:", file=sys.stderr)
-        for i, (local_path, temp_path, plex_path) in enumerate(move_operations):
-            album_name = os.path.basename(local_path)
-            temp_dir = os.path.dirname(temp_path)
-            print(f"  [{i+1}/{len(move_operations)}] {album_name} -> {temp_dir}...", file=sys.stderr, end=" ")
-            result = move_file(local_path, temp_path, plex_path)
-            print("✓" if result else "✗", file=sys.stderr)
-            results.append(result)
+            header = ("#!/bin/bash\n"
+                      "# Restore script for plex-dance operation\n"
+                      f"# Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            with open(restore_log, 'w', buffering=1 << 16) as f:
+                f.write(header + ''.join(restore_commands[temp_dir]))
         
-        # Update global variables for signal handling
+        # Update global variables for signal handling before any album is moved
         file_paths = [op[0] for op in move_operations]  # local paths
         
+        # Execute moves concurrently, except albums nested inside another listed
+        # album: those run one at a time afterwards, parents first, so a parent's
+        # move takes its children along exactly as a sequential run would.
+        # results[i] still lines up with move_operations[i]
+        results = [False] * len(move_operations)
+        local_path_set = set(file_paths)
+        nested_moves = sorted((i for i, op in enumerate(move_operations) if has_ancestor_in(op[0], local_path_set)),
+                              key=lambda i: move_operations[i][0])
+        nested_move_set = set(nested_moves)
+        # Hold one descriptor per temp directory so renames skip resolving it each time
+        temp_dir_fds = {}
+        if os.rename in os.supports_dir_fd:
+            for temp_dir in library_temp_dirs.values():
+                temp_dir_fds[temp_dir] = os.open(temp_dir, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+        print("Moving albums:", file=sys.stderr)
+        try:
+            progress_buf = []
+            
+            def record_move(i, result):
+                local_path, temp_path, _ = move_operations[i]
+                album_name = os.path.basename(local_path)
+                temp_dir = os.path.dirname(temp_path)
+                progress_buf.append(f"  [{i+1}/{len(move_operations)}] {album_name} -> {temp_dir}... {'✓' if result else '✗'}\n")
+                if not result or len(progress_buf) >= PROGRESS_FLUSH_EVERY:
+                    flush_progress(progress_buf)
+                results[i] = result
+            
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = {i: executor.submit(move_file, local_path, temp_path, plex_path,
+                                              temp_dir_fds.get(os.path.dirname(temp_path)))
+                           for i, (local_path, temp_path, plex_path) in enumerate(move_operations)
+                           if i not in nested_move_set}
+                for i, future in futures.items():
+                    record_move(i, future.result())
+            for i in nested_moves:
+                local_path, temp_path, plex_path = move_operations[i]
+                record_move(i, move_file(local_path, temp_path, plex_path,
+                                         temp_dir_fds.get(os.path.dirname(temp_path))))
+            flush_progress(progress_buf)
+        finally:
+            for fd in temp_dir_fds.values():
+                os.close(fd)
+        
         failed_moves = sum(1 for result in results if not result)
         successful_moves = len(results) - failed_moves
         
@@ -647,37 +818,50 @@ def main():
         # Phase 2: Wait for Plex to notice the changes
         if not args.skip_validation:
             print("Phase 2: Waiting for Plex to notice the changes...")
-            poll_interval = 5  # Check every 5 seconds
+            # Poll quickly at first, then back off exponentially up to --poll-max-interval;
+            # elapsed time comes from the monotonic clock so the time spent checking counts
+            poll_attempts = 0
             max_wait_time = args.max_wait
+            start_time = time.monotonic()
             elapsed_time = 0
             
-            # Initial check
-            moved_plex_paths = [move_operations[i][2] for i, result in enumerate(results) if result]
+            # (plex_path, album_ids) for every successfully moved album; this shrinks
+            # as Plex stops seeing albums so each poll only re-checks the rest
+            moved_albums_with_ids = [(move_operations[i][2], album_ids_map.get(move_operations[i][2], []))
+                                     for i, result in enumerate(results) if result]
+            total_moved = len(moved_albums_with_ids)
+            
+            # Connect once and reuse the library section for every poll
+            music_library = None
+            all_removed = False
             
             while elapsed_time < max_wait_time:
-                print(f"⏳ Checking Plex library ({elapsed_time}s elapsed)...", file=sys.stderr, end=" ", flush=True)
+                print(f"⏳ Checking Plex library ({elapsed_time:.0f}s elapsed)...", file=sys.stderr, end=" ", flush=True)
                 
-                # Create list of (plex_path, album_ids) tuples for checking
-                moved_albums_with_ids = []
-                for i, result in enumerate(results):
-                    if result:  # Only check successfully moved albums
-                        plex_path = move_operations[i][2]  # Original Plex path
-                        album_ids = album_ids_map.get(plex_path, [])
-                        moved_albums_with_ids.append((plex_path, album_ids))
-                
-                all_removed, still_visible_count = check_albums_removed_from_plex(
-                    args.plex_url, args.plex_token, args.music_library, 
-                    moved_albums_with_ids, path_mapping
-                )
+                if music_library is None:
+                    try:
+                        print("connecting...", file=sys.stderr, end=" ", flush=True)
+                        plex = PlexServer(args.plex_url, args.plex_token)
+                        music_library = plex.library.section(args.music_library)
+                    except Exception as e:
+                        print(f"Warning: Could not check Plex status: {e}", file=sys.stderr)
                 
-                if all_removed:
-                    print(f"✅ All albums temporarily moved!", file=sys.stderr)
-                    print(f"✅ Plex has noticed all changes after {elapsed_time} seconds!", file=sys.stderr)
-                    break
+                if music_library is not None:
+                    all_removed, moved_albums_with_ids = check_albums_removed_from_plex(
+                        music_library, moved_albums_with_ids
+                    )
+                    
+                    if all_removed:
+                        print(f"✅ All albums temporarily moved!", file=sys.stderr)
+                        print(f"✅ Plex has noticed all changes after {time.monotonic() - start_time:.0f} seconds!", file=sys.stderr)
+                        break
+                    
+                    print(f"{len(moved_albums_with_ids)}/{total_moved} albums still visible", file=sys.stderr)
                 
-                print(f"{still_visible_count}/{len(moved_plex_paths)} albums still visible", file=sys.stderr)
-                time.sleep(poll_interval)
-                elapsed_time += poll_interval
+                poll_interval = min(args.poll_max_interval, args.poll_base_interval * (1.5 ** poll_attempts))
+                poll_attempts += 1
+                time.sleep(min(poll_interval, max(0, max_wait_time - (time.monotonic() - start_time))))
+                elapsed_time = time.monotonic() - start_time
             
             if elapsed_time >= max_wait_time and not all_removed:
                 print(f"⏰ Timeout reached ({max_wait_time}s), proceeding with restore...", file=sys.stderr)
@@ -687,23 +871,57 @@ def main():
         
         # Phase 3: Restore all files
         print("Phase 3: Restoring files to original locations...")
+        _appledouble_siblings.cache_clear()  # temp directories have been filled since Phase 1
         restore_operations = []
         
+        # List each temp directory once instead of stat'ing every temp path
+        temp_dir_contents = {}
+        for temp_dir in library_temp_dirs.values():
+            try:
+                with os.scandir(temp_dir) as entries:
+                    temp_dir_contents[temp_dir] = {entry.name for entry in entries}
+            except OSError:
+                temp_dir_contents[temp_dir] = set()
+        
         for i, orig_path in enumerate(file_paths):
             temp_path = temp_paths[i]
-            if os.path.exists(temp_path):  # Only restore if temp file exists
+            temp_dir, temp_name = os.path.split(temp_path)
+            if temp_name in temp_dir_contents.get(temp_dir, ()):  # Only restore if temp file exists
                 restore_operations.append((temp_path, orig_path))
         
-        # Execute restores sequentially with progress indication
-        results = []
+        # Execute restores concurrently, reporting progress as each one completes;
+        # albums nested inside another restored album go afterwards, parents first.
+        # results[i] still lines up with restore_operations[i]
+        results = [False] * len(restore_operations)
+        orig_path_set = {orig_path for _, orig_path in restore_operations}
+        nested_restores = sorted((i for i, (_, orig_path) in enumerate(restore_operations)
+                                  if has_ancestor_in(orig_path, orig_path_set)),
+                                 key=lambda i: restore_operations[i][1])
+        nested_restore_set = set(nested_restores)
         print("Restoring albums:", file=sys.stderr)
-        for i, (temp_path, orig_path) in enumerate(restore_operations):
+        progress_buf = []
+        done = 0
+        
+        def record_restore(i, result):
+            nonlocal done
+            done += 1
+            temp_path, orig_path = restore_operations[i]
             album_name = os.path.basename(orig_path)
             temp_dir = os.path.dirname(temp_path)
-            print(f"  [{i+1}/{len(restore_operations)}] {album_name} <- {temp_dir}...", file=sys.stderr, end=" ")
-            result = restore_file(temp_path, orig_path)
-            print("✓" if result else "✗", file=sys.stderr)
-            results.append(result)
+            progress_buf.append(f"  [{done}/{len(restore_operations)}] {album_name} <- {temp_dir}... {'✓' if result else '✗'}\n")
+            if not result or len(progress_buf) >= PROGRESS_FLUSH_EVERY:
+                flush_progress(progress_buf)
+            results[i] = result
+        
+        with ThreadPoolExecutor(max_workers=args.restore_parallelism) as executor:
+            futures = {executor.submit(restore_file, temp_path, orig_path): i
+                       for i, (temp_path, orig_path) in enumerate(restore_operations)
+                       if i not in nested_restore_set}
+            for future in as_completed(futures):
+                record_restore(futures[future], future.result())
+        for i in nested_restores:
+            record_restore(i, restore_file(*restore_operations[i]))
+        flush_progress(progress_buf)
         
         failed_restores = sum(1 for result in results if not result)
         if failed_restores > 0:
@@ -718,7 +936,7 @@ def main():
         
     except Exception as e:
         print(f"Error during operation: {e}", file=sys.stderr)
-        # cleanup_and_restore will be called by atexit or signal handler
+        # cleanup_and_restore will be called by atexit
         raise
 
 if __name__ == "__main__":
@@ -1,69 +1,108 @@
 #!/usr/bin/env python3
 from collections import defaultdict
+import argparse
+import os
 import sys
+from xml.etree import ElementTree
 from plexapi.server import PlexServer
 
+# Tracks requested per page when listing the library
+TRACK_PAGE_SIZE = 10000
+# Query options that skip the heavy fields and extras; this script only reads
+# each track's album ID and part file paths
+TRACK_LIST_OPTIONS = ('checkFiles=0&includeExtras=0&includeOnDeck=0&includeChapters=0'
+                      '&includePopularLeaves=0&includeRelated=0&includeStations=0'
+                      '&excludeFields=thumb,art,summary,grandparentThumb,parentThumb')
+
+def iter_track_elements(plex, section_key):
+    """Yield each <Track> element of a library section's track listing
+    
+    The listing is requested a page at a time and parsed incrementally from
+    the HTTP response. Each element is discarded once the caller has handled
+    it, so memory stays flat however large the library is.
+    
+    Streaming bypasses plex.query(), so this relies on the private
+    PlexServer._session, _headers() and _timeout attributes; if a plexapi
+    upgrade renames them, this is the function that breaks.
+    """
+    start = 0
+    while True:
+        key = (f'/library/sections/{section_key}/all?type=10&{TRACK_LIST_OPTIONS}'
+               f'&X-Plex-Container-Start={start}&X-Plex-Container-Size={TRACK_PAGE_SIZE}')
+        page_count = 0
+        with plex._session.get(plex.url(key), headers=plex._headers(),
+                               timeout=plex._timeout, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            root = None
+            for event, elem in ElementTree.iterparse(response.raw, events=('start', 'end')):
+                if root is None:
+                    root = elem  # MediaContainer
+                elif event == 'end' and elem.tag == 'Track':
+                    yield elem
+                    page_count += 1
+                    root.clear()
+        if page_count < TRACK_PAGE_SIZE:
+            return
+        start += TRACK_PAGE_SIZE
+
 def load_plex_data(plex_url, plex_token, music_library_name='Music'):
-    """Load all track data with album ID and file directory."""
-    import sys
-    import os
+    """Load all track data with album ID and file directory.
     
+    Returns parallel lists (directories, album_ids), one entry per media file.
+    Strings are interned, so the many tracks sharing a directory or album
+    share a single string object.
+    """
     plex = PlexServer(plex_url, plex_token)
     music_library = plex.library.section(music_library_name)
     
-    data = []
+    directories = []
+    album_ids = []
     
-    # Get all tracks at once - much more efficient than album-by-album
+    # Stream track XML straight from the library listing instead of building
+    # PlexAPI Track objects and touching their lazy attributes
     print("Fetching all tracks...", file=sys.stderr, flush=True)
-    all_tracks = music_library.searchTracks()
-    print(f"Retrieved {len(all_tracks)} tracks, processing...", file=sys.stderr, flush=True)
-    
-    for track in all_tracks:
-        # Get album ID from parent key and directory from track location
-        album_id = str(track.parentRatingKey) if hasattr(track, 'parentRatingKey') else None
+    track_count = 0
+    for track in iter_track_elements(plex, music_library.key):
+        # Get album ID from parent key and directory from each media part's file
+        album_id = track.get('parentRatingKey')
+        if album_id:
+            album_id = sys.intern(album_id)
+            for part in track.iter('Part'):
+                location = part.get('file')
+                if location:
+                    directories.append(sys.intern(os.path.dirname(location)))
+                    album_ids.append(album_id)
         
-        if album_id and hasattr(track, 'locations') and track.locations:
-            for location in track.locations:
-                directory = os.path.dirname(location)
-                data.append({
-                    'directory': directory,
-                    'album_id': album_id
-                })
+        track_count += 1
+        if track_count % TRACK_PAGE_SIZE == 0:
+            print(f"Retrieved {track_count} tracks...", file=sys.stderr, flush=True)
     
-    print(f"Finished processing {len(all_tracks)} tracks", file=sys.stderr)
-    return data
+    print(f"Finished processing {track_count} tracks", file=sys.stderr)
+    return directories, album_ids
 
-def find_broken_albums(data):
+def find_broken_albums(directories, album_ids):
     """Find broken albums: directories with multiple album IDs and album IDs spanning multiple directories."""
     broken_albums = {}  # directory -> set of album IDs
     
-    # Group by directory
-    directories = defaultdict(list)
-    for row in data:
-        directory = row['directory']
-        album_id = row['album_id']
+    # Group by directory and by album ID in a single pass
+    directory_albums = defaultdict(set)
+    albums = defaultdict(set)
+    for directory, album_id in zip(directories, album_ids):
         if directory and album_id:
-            directories[directory].append(album_id)
+            directory_albums[directory].add(album_id)
+            albums[album_id].add(directory)
     
     # Check for multiple album IDs within the same directory
-    for directory, album_ids in directories.items():
-        unique_album_ids = set(album_ids)
-        if len(unique_album_ids) > 1:
-            broken_albums[directory] = unique_album_ids
-    
-    # Group by album ID
-    albums = defaultdict(list)
-    for row in data:
-        directory = row['directory']
-        album_id = row['album_id']
-        if directory and album_id:
-            albums[album_id].append(directory)
+    # The grouping sets are not used again, so they are taken over rather than copied
+    for directory, ids in directory_albums.items():
+        if len(ids) > 1:
+            broken_albums[directory] = ids
     
     # Check for multiple directories within the same album ID
     for album_id, dirs in albums.items():
-        unique_dirs = set(dirs)
-        if len(unique_dirs) > 1:
-            for directory in unique_dirs:
+        if len(dirs) > 1:
+            for directory in dirs:
                 if directory in broken_albums:
                     broken_albums[directory].add(album_id)
                 else:
@@ -73,8 +112,6 @@ def find_broken_albums(data):
 
 def print_plex_dance_output(broken_albums):
     """Print file paths with album IDs in format ready for plex-dance.py."""
-    import sys
-    
     if not broken_albums:
         print("No broken albums found.", file=sys.stderr)
         return
@@ -86,9 +123,6 @@ def print_plex_dance_output(broken_albums):
         print(f"{directory}\t{album_ids_str}")
 
 def main():
-    import argparse
-    import os
-    
     parser = argparse.ArgumentParser(
         description="Find broken albums in Plex library - directories with tracks mapped to different album IDs and vice-versa.",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -121,10 +155,10 @@ Examples:
     
     try:
         # Load Plex data and find broken album files
-        plex_data = load_plex_data(args.plex_url, args.plex_token, args.music_library)
-        print(f"Analyzing {len(plex_data)} track entries for broken albums...", file=sys.stderr)
+        directories, album_ids = load_plex_data(args.plex_url, args.plex_token, args.music_library)
+        print(f"Analyzing {len(directories)} track entries for broken albums...", file=sys.stderr)
         
-        broken_albums = find_broken_albums(plex_data)
+        broken_albums = find_broken_albums(directories, album_ids)
         
         # Print file paths with album IDs for plex-dance.py
         print_plex_dance_output(broken_albums)
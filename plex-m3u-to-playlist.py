@@ -8,21 +8,45 @@ Converts relative paths (../) to absolute paths
 import sys
 import os
 import argparse
+import bisect
+import functools
 from pathlib import Path
+from xml.etree import ElementTree
 from plexapi.server import PlexServer
 from plexapi.exceptions import NotFound
 
+# Tracks requested per page when indexing the library
+TRACK_PAGE_SIZE = 10000
+# Query options that skip the heavy fields and extras; this script only reads
+# each track's rating key and part file paths
+TRACK_LIST_OPTIONS = ('checkFiles=0&includeExtras=0&includeOnDeck=0&includeChapters=0'
+                      '&includePopularLeaves=0&includeRelated=0&includeStations=0'
+                      '&excludeFields=thumb,art,summary,grandparentThumb,parentThumb')
+# Rating keys requested per /library/metadata/{keys} call
+METADATA_BATCH_SIZE = 200
+
 def parse_m3u(m3u_file, local_to_plex_mapping=None):
     """Parse M3U file and return list of file paths
     
     Args:
         m3u_file: Path to the M3U playlist file
-        local_to_plex_mapping: Dict mapping local paths to Plex paths (optional)
+        local_to_plex_mapping: Dict from parse_path_mapping (optional)
     """
     tracks = []
     m3u_path = Path(m3u_file).resolve()
     m3u_dir = m3u_path.parent
     
+    # Tracks from the same album share a directory, so resolve and map each
+    # directory once. The caches live for this call only, so each M3U file
+    # starts fresh.
+    @functools.lru_cache(maxsize=None)
+    def resolve_dir(rel_dir):
+        return str((m3u_dir / rel_dir).resolve())
+    
+    @functools.lru_cache(maxsize=None)
+    def map_dir(directory):
+        return map_local_dir(directory, local_to_plex_mapping)
+    
     with open(m3u_file, 'r', encoding='utf-8') as f:
         for line in f:
             line = line.strip()
@@ -35,72 +59,186 @@ def parse_m3u(m3u_file, local_to_plex_mapping=None):
             
             # Handle relative paths by resolving them relative to the M3U file location
             if not os.path.isabs(track_path):
-                # Resolve relative path based on M3U file location
-                absolute_local_path = (m3u_dir / track_path).resolve()
-                track_path = str(absolute_local_path)
+                # Resolve the entry's directory based on M3U file location
+                rel_dir, basename = os.path.split(track_path)
+                if basename in ('', '.', '..'):
+                    track_path = resolve_dir(track_path)  # entry names a directory itself
+                else:
+                    track_path = os.path.join(resolve_dir(rel_dir), basename)
             
             # Apply path mapping if provided
             if local_to_plex_mapping:
-                track_path = apply_path_mapping(track_path, local_to_plex_mapping)
+                directory, basename = os.path.split(os.path.normpath(track_path))
+                plex_dir = map_dir(directory)
+                if plex_dir is not None:
+                    track_path = plex_dir + '/' + basename
             
             tracks.append(track_path)
     
     return tracks
 
-def apply_path_mapping(path, mapping):
-    """Apply path mapping from local system to Plex container paths
+def map_local_dir(directory, mapping):
+    """Map a normalised local directory to its Plex container directory
+    
+    Uses string operations only; the local root was resolved once by
+    parse_path_mapping, so no per-path filesystem lookups are needed.
     
     Args:
-        path: Local file path
-        mapping: Dict with 'local_root' and 'plex_root' keys
+        directory: Normalised absolute local directory
+        mapping: Dict from parse_path_mapping
     
     Returns:
-        Mapped path for Plex
+        Plex directory using forward slashes, or None if directory is not
+        under the local root
     """
-    if not mapping or 'local_root' not in mapping or 'plex_root' not in mapping:
-        return path
-    
-    local_root = Path(mapping['local_root']).resolve()
     plex_root = mapping['plex_root']
-    path_obj = Path(path).resolve()
     
-    # Check if the path is under the local root
-    try:
-        relative_path = path_obj.relative_to(local_root)
-        # Convert to Plex path using forward slashes
-        plex_path = plex_root + '/' + str(relative_path).replace('\\', '/')
-        return plex_path
-    except ValueError:
-        # Path is not under local_root, return unchanged
-        return path
+    # Check if the directory is under the local root (as given or resolved)
+    for local_root in mapping['local_roots']:
+        root = local_root.rstrip(os.sep)
+        if directory == root:
+            return plex_root
+        if directory.startswith(root + os.sep):
+            return plex_root + '/' + directory[len(root) + 1:].replace('\\', '/')
+    return None
+
+def iter_track_elements(plex, section_key):
+    """Yield each <Track> element of a library section's track listing
+    
+    The listing is requested a page at a time and parsed incrementally from
+    the HTTP response. Each element is discarded once the caller has handled
+    it, so memory stays flat however large the library is.
+    
+    Streaming bypasses plex.query(), so this relies on the private
+    PlexServer._session, _headers() and _timeout attributes; if a plexapi
+    upgrade renames them, this is the function that breaks.
+    """
+    start = 0
+    while True:
+        key = (f'/library/sections/{section_key}/all?type=10&{TRACK_LIST_OPTIONS}'
+               f'&X-Plex-Container-Start={start}&X-Plex-Container-Size={TRACK_PAGE_SIZE}')
+        page_count = 0
+        with plex._session.get(plex.url(key), headers=plex._headers(),
+                               timeout=plex._timeout, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            root = None
+            for event, elem in ElementTree.iterparse(response.raw, events=('start', 'end')):
+                if root is None:
+                    root = elem  # MediaContainer
+                elif event == 'end' and elem.tag == 'Track':
+                    yield elem
+                    page_count += 1
+                    root.clear()
+        if page_count < TRACK_PAGE_SIZE:
+            return
+        start += TRACK_PAGE_SIZE
+
+def build_file_index(plex_server, music):
+    """Map every media part file in the library to its track rating key
+    
+    Streams the raw library XML rather than building a PlexAPI Track object
+    (and walking its media/parts) for every track.
+    """
+    file_to_track = {}
+    for track in iter_track_elements(plex_server, music.key):
+        rating_key = int(track.get('ratingKey'))
+        for part in track.iter('Part'):
+            file_to_track[part.get('file')] = rating_key
+    return file_to_track
+
+def fetch_tracks(plex_server, rating_keys):
+    """Fetch full track objects for the given rating keys, a batch per request
+    
+    Returns:
+        Dict mapping rating key to track
+    """
+    tracks_by_key = {}
+    unique_keys = list(dict.fromkeys(rating_keys))
+    for start in range(0, len(unique_keys), METADATA_BATCH_SIZE):
+        batch = unique_keys[start:start + METADATA_BATCH_SIZE]
+        for track in plex_server.fetchItems(f"/library/metadata/{','.join(map(str, batch))}"):
+            tracks_by_key[track.ratingKey] = track
+    return tracks_by_key
+
+def reorder_playlist(playlist, current_keys, tracks):
+    """Move playlist items into the order of tracks using as few moves as possible
+    
+    Items on the longest run already in target order (a longest increasing
+    subsequence of their target positions) stay put; every other item is moved
+    directly after its predecessor in the target order. Rating keys must be
+    unique and current_keys must contain the same keys as tracks.
+    
+    Returns:
+        Number of items moved
+    """
+    target_keys = [track.ratingKey for track in tracks]
+    if current_keys == target_keys:
+        return 0
+    
+    # Longest increasing subsequence of target positions in current order
+    target_position = {key: i for i, key in enumerate(target_keys)}
+    positions = [target_position[key] for key in current_keys]
+    tail_positions = []  # smallest final position of an increasing run of each length
+    tail_indices = []    # index in current_keys where that run ends
+    predecessor = [-1] * len(positions)
+    for i, position in enumerate(positions):
+        k = bisect.bisect_left(tail_positions, position)
+        if k > 0:
+            predecessor[i] = tail_indices[k - 1]
+        if k == len(tail_positions):
+            tail_positions.append(position)
+            tail_indices.append(i)
+        else:
+            tail_positions[k] = position
+            tail_indices[k] = i
+    keep = set()
+    i = tail_indices[-1] if tail_indices else -1
+    while i >= 0:
+        keep.add(current_keys[i])
+        i = predecessor[i]
+    
+    # Refresh cached items so newly added tracks have playlist item IDs
+    playlist.reload()
+    moves = 0
+    for i, track in enumerate(tracks):
+        if track.ratingKey not in keep:
+            playlist.moveItem(track, after=tracks[i - 1] if i else None)
+            moves += 1
+    return moves
 
 def sync_plex_playlist(plex_server, playlist_name, track_paths, music_library):
     """Create or update playlist in Plex to match the given tracks exactly"""
     try:
+        # Drop repeated entries, keeping the first occurrence's position
+        unique_paths = list(dict.fromkeys(track_paths))
+        if len(unique_paths) != len(track_paths):
+            print(f"Found {len(unique_paths)} unique tracks after dedupe")
+            track_paths = unique_paths
+        
         # Get the music library
         music = plex_server.library.section(music_library)
         
         print(f"Building track file path index from Plex library...")
-        # Build a dictionary mapping file paths to tracks for faster lookup
-        file_to_track = {}
-        all_tracks = music.searchTracks()
-        for track in all_tracks:
-            for media in track.media:
-                for part in media.parts:
-                    file_to_track[part.file] = track
+        # Build a dictionary mapping file paths to track rating keys for faster lookup
+        file_to_track = build_file_index(plex_server, music)
         
         print(f"Found {len(file_to_track)} tracks in Plex library")
         
         # Find tracks in Plex library
-        plex_tracks = []
+        rating_keys = []
         not_found = []
         
         for track_path in track_paths:
             if track_path in file_to_track:
-                plex_tracks.append(file_to_track[track_path])
+                rating_keys.append(file_to_track[track_path])
             else:
                 not_found.append(track_path)
         
+        # Only the tracks in the M3U are fetched as full objects
+        tracks_by_key = fetch_tracks(plex_server, rating_keys)
+        plex_tracks = [tracks_by_key[key] for key in rating_keys if key in tracks_by_key]
+        
         if not_found:
             print(f"Warning: {len(not_found)} tracks not found in Plex library:")
             for track in not_found:
@@ -126,17 +264,16 @@ def sync_plex_playlist(plex_server, playlist_name, track_paths, music_library):
             # Find tracks to add (in new but not in existing)
             tracks_to_add = [track for track in plex_tracks if track.ratingKey not in existing_track_ids]
             
-            # Check if order needs to change by comparing the full sequence
-            order_changed = False
-            if len(existing_items) == len(plex_tracks):
-                # Same length, check if order matches
-                for i, (existing, new) in enumerate(zip(existing_items, plex_tracks)):
-                    if existing.ratingKey != new.ratingKey:
-                        order_changed = True
-                        break
-            else:
+            # Check if order needs to change, only walking the sequence when membership matches
+            if len(existing_items) != len(plex_tracks):
                 # Different lengths mean order will definitely change
                 order_changed = True
+            elif existing_track_ids != new_track_ids:
+                # Same length but different tracks, so the sequence can't match
+                order_changed = True
+            else:
+                order_changed = any(existing.ratingKey != new.ratingKey
+                                    for existing, new in zip(existing_items, plex_tracks))
             
             # Report all changes
             if tracks_to_remove:
@@ -154,11 +291,22 @@ def sync_plex_playlist(plex_server, playlist_name, track_paths, music_library):
                 for track in plex_tracks:
                     print(f"~ {track.title} - {track.grandparentTitle}")
             
-            # Apply changes: always rebuild playlist to ensure correct order
+            # Apply changes as a diff: remove, append, then move only out-of-order items
             if tracks_to_remove or tracks_to_add or order_changed:
                 print("Updating playlist to match M3U...")
-                existing_playlist.removeItems(existing_playlist.items())
-                existing_playlist.addItems(plex_tracks)
+                if len(existing_track_ids) != len(existing_items) or len(new_track_ids) != len(plex_tracks):
+                    # Duplicate tracks can't be diffed by rating key, so rebuild instead
+                    existing_playlist.removeItems(existing_playlist.items())
+                    existing_playlist.addItems(plex_tracks)
+                else:
+                    if tracks_to_remove:
+                        existing_playlist.removeItems(tracks_to_remove)
+                    if tracks_to_add:
+                        existing_playlist.addItems(tracks_to_add)
+                    # addItems appends, so this is the playlist order after the edits above
+                    current_keys = [item.ratingKey for item in existing_items if item.ratingKey in new_track_ids]
+                    current_keys += [track.ratingKey for track in tracks_to_add]
+                    reorder_playlist(existing_playlist, current_keys, plex_tracks)
                 print(f"Updated playlist '{playlist_name}' - now has {len(plex_tracks)} tracks")
             else:
                 print(f"Playlist '{playlist_name}' is already up to date with {len(plex_tracks)} tracks")
@@ -188,8 +336,13 @@ def parse_path_mapping(mapping_str):
     
     try:
         local_root, plex_root = mapping_str.split(':', 1)
+        local_root = local_root.strip()
+        # Resolve the local root once here rather than for every M3U entry; the
+        # unresolved spelling is kept too for entries that go through a symlink
+        local_roots = list(dict.fromkeys([str(Path(local_root).resolve()), os.path.normpath(local_root)]))
         return {
-            'local_root': local_root.strip(),
+            'local_root': local_root,
+            'local_roots': local_roots,
             'plex_root': plex_root.strip()
         }
     except ValueError:
@@ -6,8 +6,60 @@ Script to remove all user ratings from tracks in Plex music libraries
 import sys
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from plexapi.server import PlexServer
 
+def create_session(pool_size):
+    """Create the requests session used for all Plex calls
+    
+    Keeps up to pool_size connections alive so concurrent rating requests don't
+    churn connections, and retries with backoff on rate limiting and server errors.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def remove_ratings(items, kind, artist_attr, parallel):
+    """Remove ratings from items with up to parallel concurrent requests
+    
+    Args:
+        items: Rated tracks or albums
+        kind: 'track' or 'album', used in progress output
+        artist_attr: Attribute holding the artist name for this kind of item
+        parallel: Maximum number of rating requests in flight
+    
+    Returns:
+        Number of ratings successfully removed
+    """
+    success_count = 0
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {}
+        for item in items:
+            # Describe the item before rating it, in case rate() reloads it
+            try:
+                artist = getattr(item, artist_attr, 'Unknown Artist')
+                rating = getattr(item, 'userRating', None)
+                description = f"{artist} - {item.title} (rating: {rating})"
+            except Exception as e:
+                print(f"Error removing {kind} rating: {e}")
+                continue
+            futures[executor.submit(item.rate, None)] = description
+        
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+                print(f"[{i}/{len(futures)}] Removed {kind} rating: {futures[future]}")
+                success_count += 1
+            except Exception as e:
+                print(f"Error removing {kind} rating: {futures[future]}: {e}")
+    return success_count
+
 def main():
     parser = argparse.ArgumentParser(
         description="Remove all user ratings from tracks and albums in Plex music libraries. Runs in dry-run mode by default.",
@@ -32,8 +84,12 @@ Examples:
     parser.add_argument('--no-dry-run', 
                        action='store_true',
                        help='Actually remove ratings (default is dry-run mode)')
+    parser.add_argument('--parallel', 
+                       type=int, default=8,
+                       help='Number of ratings to remove concurrently; 1 removes them one at a time (default: 8)')
     
     args = parser.parse_args()
+    args.parallel = max(1, args.parallel)
     
     plex_url = args.plex_url
     plex_token = args.plex_token
@@ -51,7 +107,7 @@ Examples:
     # Connect to the Plex server
     try:
         print(f"Connecting to Plex server: {plex_url}")
-        plex = PlexServer(plex_url, plex_token)
+        plex = PlexServer(plex_url, plex_token, session=create_session(args.parallel))
         print(f"Connected to Plex server: {plex.friendlyName}")
     except Exception as e:
         print(f"Error connecting to Plex server: {e}")
@@ -95,40 +151,32 @@ Examples:
         print(f"Found {len(rated_tracks)} rated tracks and {len(rated_albums)} rated albums.")
         
         # Remove ratings from tracks
-        for i, track in enumerate(rated_tracks, 1):
-            try:
-                title = track.title
-                artist = getattr(track, 'grandparentTitle', 'Unknown Artist')
-                rating = getattr(track, 'userRating', None)
-                
-                if dry_run:
+        if dry_run:
+            for i, track in enumerate(rated_tracks, 1):
+                try:
+                    title = track.title
+                    artist = getattr(track, 'grandparentTitle', 'Unknown Artist')
+                    rating = getattr(track, 'userRating', None)
                     print(f"[{i}/{len(rated_tracks)}] Would remove track rating: {artist} - {title} (rating: {rating})")
                     success_count += 1
-                else:
-                    print(f"[{i}/{len(rated_tracks)}] Removing track rating: {artist} - {title} (rating: {rating})")
-                    track.rate(None)
-                    success_count += 1
-                
-            except Exception as e:
-                print(f"Error removing track rating: {e}")
+                except Exception as e:
+                    print(f"Error removing track rating: {e}")
+        else:
+            success_count += remove_ratings(rated_tracks, 'track', 'grandparentTitle', args.parallel)
         
         # Remove ratings from albums
-        for i, album in enumerate(rated_albums, 1):
-            try:
-                title = album.title
-                artist = getattr(album, 'parentTitle', 'Unknown Artist')
-                rating = getattr(album, 'userRating', None)
-                
-                if dry_run:
+        if dry_run:
+            for i, album in enumerate(rated_albums, 1):
+                try:
+                    title = album.title
+                    artist = getattr(album, 'parentTitle', 'Unknown Artist')
+                    rating = getattr(album, 'userRating', None)
                     print(f"[{i}/{len(rated_albums)}] Would remove album rating: {artist} - {title} (rating: {rating})")
                     success_count += 1
-                else:
-                    print(f"[{i}/{len(rated_albums)}] Removing album rating: {artist} - {title} (rating: {rating})")
-                    album.rate(None)
-                    success_count += 1
-                
-            except Exception as e:
-                print(f"Error removing album rating: {e}")
+                except Exception as e:
+                    print(f"Error removing album rating: {e}")
+        else:
+            success_count += remove_ratings(rated_albums, 'album', 'parentTitle', args.parallel)
     
     if dry_run:
         print(f"\nDry run completed! Found {success_count} ratings that would be removed.")